@@ -0,0 +1,55 @@
+import logging
+
+# Kept free of import-time side effects: extraction pool workers import this
+# module to unpickle extract_text_from_file, and must not load the app.
+logger = logging.getLogger(__name__)
+
+# Try to import textract, fallback to basic text extraction if not available
+try:
+    import textract
+    TEXTRACT_AVAILABLE = True
+    logger.info("textract successfully imported")
+except ImportError:
+    TEXTRACT_AVAILABLE = False
+    logger.warning("textract not available, falling back to basic text extraction")
+
+# Try to import python-docx to read .docx files without textract's subprocesses
+try:
+    import docx
+    DOCX_AVAILABLE = True
+    logger.info("python-docx successfully imported")
+except ImportError:
+    DOCX_AVAILABLE = False
+    logger.warning("python-docx not available, .docx files require textract")
+
+def extract_text_from_file(file_path: str, filename: str) -> str:
+    """Extract text from various file formats.
+    
+    Runs in the extraction process pool, so failures are raised as plain
+    exceptions that can be pickled back to the event loop.
+    """
+    logger.info("Extracting text from %s", filename)
+    
+    try:
+        if filename.lower().endswith('.txt'):
+            with open(file_path, encoding='utf-8') as text_file:
+                return text_file.read()
+        
+        # python-docx reads .docx directly, skipping textract's subprocess
+        if DOCX_AVAILABLE and filename.lower().endswith('.docx'):
+            document = docx.Document(file_path)
+            text = "\n".join(paragraph.text for paragraph in document.paragraphs)
+            logger.info("Successfully extracted text from %s using python-docx", filename)
+            return text
+        
+        # For doc files
+        if TEXTRACT_AVAILABLE:
+            text = textract.process(file_path).decode('utf-8')
+            logger.info("Successfully extracted text from %s using textract", filename)
+            return text
+        else:
+            raise ValueError("Only .txt and .docx files are supported without textract installation")
+    
+    except Exception as e:
+        logger.error("Error extracting text from %s: %s", filename, e)
+        raise
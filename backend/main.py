@@ -1,14 +1,29 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Body
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict, Optional
+from fastapi.responses import ORJSONResponse
+from typing import List, Dict, Optional, Tuple
 import os
-from openai import OpenAI
+import sys
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, RateLimitError
 from dotenv import load_dotenv
 import json
 import logging
+import asyncio
 import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import base64
+import time
+import functools
+from collections import OrderedDict
+import httpx
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+import tiktoken
+
+# Uploads and embedding batches rely on asyncio.TaskGroup and ExceptionGroup; fail at import, not per request
+if sys.version_info < (3, 11):
+    raise RuntimeError("The backend requires Python 3.11 or newer")
 
 # Configure logging
 logging.basicConfig(
@@ -17,20 +32,34 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Imported after logging is configured so its optional-dependency messages are shown
+from extraction import extract_text_from_file, TEXTRACT_AVAILABLE, DOCX_AVAILABLE
 
+# Similarity search backends, in order of preference: faiss (installed from
+# requirements.txt), then optional simsimd, then plain NumPy.
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+    logger.info("faiss successfully imported")
+except ImportError:
+    FAISS_AVAILABLE = False
+    logger.warning("faiss not available, falling back to linear similarity scan")
 
-# Try to import textract, fallback to basic text extraction if not available
 try:
-    import textract
-    TEXTRACT_AVAILABLE = True
-    logger.info("textract successfully imported")
+    import simsimd
+    SIMSIMD_AVAILABLE = True
+    logger.info("simsimd successfully imported")
 except ImportError:
-    TEXTRACT_AVAILABLE = False
-    logger.warning("textract not available, falling back to basic text extraction")
+    SIMSIMD_AVAILABLE = False
+    # simsimd is only used when faiss is missing, so its absence is expected by default
+    if FAISS_AVAILABLE:
+        logger.info("simsimd not available, faiss will be used for similarity search")
+    else:
+        logger.warning("simsimd not available, falling back to NumPy similarity search")
 
 load_dotenv()
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 @app.get("/")
 async def read_root():
@@ -45,164 +74,530 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Initialize OpenAI client on one persistent HTTP/2 connection pool shared by all requests
+http_client = httpx.AsyncClient(
+    http2=True,
+    # The SDK adopts this as its default timeout; keep reads long enough for GPT-4 proposals
+    timeout=httpx.Timeout(60, read=600),
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+)
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
+# Embedding batches retry transient errors themselves, so the SDK's own retries are disabled
+embedding_client = client.with_options(max_retries=0)
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await http_client.aclose()
+
+# Text extraction is CPU bound and spawns subprocesses, run it across cores.
+# Workers are spawned rather than forked so they never inherit the event loop,
+# open sockets or threads of the server process, on every platform.
+extract_pool = ProcessPoolExecutor(
+    max_workers=os.cpu_count(),
+    mp_context=multiprocessing.get_context("spawn")
+)
+
+@app.on_event("shutdown")
+def shutdown_extract_pool():
+    extract_pool.shutdown()
+
+# Maximum number of uploaded files processed concurrently
+upload_semaphore = asyncio.Semaphore(5)
+# Largest accepted upload, and the block size used to stream it to disk
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+UPLOAD_READ_BYTES = 1024 * 1024
+
+# Embedding model settings
+EMBEDDING_MODEL = "text-embedding-ada-002"
+# Inputs per embeddings request; large files are split into concurrent batches
+EMBEDDING_BATCH_SIZE = 96
+# Maximum number of embeddings requests in flight across the process
+embedding_semaphore = asyncio.Semaphore(5)
+EMBEDDING_MAX_ATTEMPTS = 5
+# Longest server-requested Retry-After the embedding retries will wait, in seconds
+EMBEDDING_MAX_RETRY_DELAY = 60
+EMBEDDING_DIM = 1536
+# Maximum number of chunk embeddings kept for reuse across uploads (~3 KB each as float16, ~15 MB at capacity)
+EMBEDDING_CACHE_SIZE = 5000
+# Embeddings are stored in half precision to halve memory and scan bandwidth
+EMBEDDING_DTYPE = np.float16
+# Rows upcast to float32 at a time by the NumPy similarity fallback
+SIMILARITY_BLOCK_ROWS = 4096
+
+# Retrieval results are reused for queries within this cosine similarity of a cached one
+QUERY_CACHE_THRESHOLD = 0.95
+QUERY_CACHE_SIZE = 128
+QUERY_CACHE_TTL = 300
+
+# Tokenizer used to size chunks for the embedding model; downloaded on first use
+# unless already in TIKTOKEN_CACHE_DIR (see README)
+encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """L2-normalize embeddings along the last axis so cosine similarity is a dot product."""
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, np.finfo(embeddings.dtype).tiny)
+
+def chunk_key(chunk: str) -> bytes:
+    """Identify a chunk by the SHA-256 of its text."""
+    return hashlib.sha256(chunk.encode('utf-8')).digest()
+
+def is_retryable_error(error: Exception) -> bool:
+    """Whether an OpenAI error is transient, following the SDK's own retry rules."""
+    if isinstance(error, RateLimitError):
+        # An exhausted quota does not recover by waiting
+        return error.code != "insufficient_quota"
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 409) or error.status_code >= 500
+    # Connection failures and timeouts
+    return isinstance(error, APIConnectionError)
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """Seconds to wait before a retry, preferring the server's Retry-After hint."""
+    if isinstance(error, APIStatusError):
+        headers = error.response.headers
+        try:
+            if "retry-after-ms" in headers:
+                return min(float(headers["retry-after-ms"]) / 1000, EMBEDDING_MAX_RETRY_DELAY)
+            if "retry-after" in headers:
+                return min(float(headers["retry-after"]), EMBEDDING_MAX_RETRY_DELAY)
+        except ValueError:
+            pass
+    return 2 ** attempt
+
+def retry_on_transient_error(func):
+    """Retry an async OpenAI call with backoff on rate limits, server errors and dropped connections."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        for attempt in range(EMBEDDING_MAX_ATTEMPTS):
+            try:
+                return await func(*args, **kwargs)
+            except (APIConnectionError, APIStatusError) as e:
+                if attempt == EMBEDDING_MAX_ATTEMPTS - 1 or not is_retryable_error(e):
+                    raise
+                delay = retry_delay(e, attempt)
+                logger.warning("OpenAI request failed (%s), retrying in %.1fs", e, delay)
+                await asyncio.sleep(delay)
+    return wrapper
+
+@retry_on_transient_error
+async def embed_batch(texts: List[str]) -> np.ndarray:
+    """Embed one batch of texts in a single API request."""
+    async with embedding_semaphore:
+        # base64 lets the float32 vectors be decoded straight into an array
+        # instead of through one Python float per dimension
+        response = await embedding_client.embeddings.create(model=EMBEDDING_MODEL, input=texts, encoding_format="base64")
+    raw = b"".join(base64.b64decode(d.embedding) for d in response.data)
+    return np.frombuffer(raw, dtype=np.float32).reshape(len(response.data), EMBEDDING_DIM)
 
-# Store uploaded contents and their embeddings in memory
+# Store uploaded contents and their embeddings, optionally persisted to storage_dir
 class DocumentStore:
-    def __init__(self):
-        self.documents: List[Dict] = []
-        self.chunk_size = 1000
-        self.chunk_overlap = 200
+    def __init__(self, storage_dir: Optional[str] = None):
+        # Row i of the L2-normalized embedding matrix belongs to contents[i]
+        self.embeddings = np.empty((0, EMBEDDING_DIM), dtype=EMBEDDING_DTYPE)
+        self.contents: List[str] = []
+        self.filenames: List[str] = []
+        # Keys of every stored chunk, so re-uploaded text is not stored twice
+        self._stored_keys: set = set()
+        # Inner product over unit-length vectors is cosine similarity; vectors are held as fp16
+        self.index = faiss.IndexScalarQuantizer(
+            EMBEDDING_DIM, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT
+        ) if FAISS_AVAILABLE else None
+        # LRU cache of normalized embeddings keyed by SHA-256 of the chunk text
+        self._emb_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        # Recent retrievals as (query, top_k, query embedding, chunks, timestamp), oldest first
+        self.query_cache: List[Tuple[str, int, np.ndarray, List[str], float]] = []
+        # Chunk size and overlap are measured in tokens
+        self.chunk_size = 512
+        self.chunk_overlap = 64
+        # Embeddings are appended as raw rows and memory-mapped, contents as JSON lines
+        self.storage_dir = storage_dir
+        if storage_dir:
+            self._embeddings_path = os.path.join(storage_dir, "embeddings.bin")
+            self._contents_path = os.path.join(storage_dir, "contents.jsonl")
+            self._load()
+        
+    def _map_embeddings(self, count: int) -> np.ndarray:
+        """Memory-map the first count persisted embedding rows."""
+        if count == 0:
+            return np.empty((0, EMBEDDING_DIM), dtype=EMBEDDING_DTYPE)
+        return np.memmap(self._embeddings_path, dtype=EMBEDDING_DTYPE, mode='r', shape=(count, EMBEDDING_DIM))
+    
+    def _load(self):
+        """Restore persisted chunks so nothing is re-embedded after a restart."""
+        os.makedirs(self.storage_dir, exist_ok=True)
+        if not os.path.exists(self._contents_path) or not os.path.exists(self._embeddings_path):
+            # One file without the other can't be reloaded; keep it for inspection instead of overwriting it
+            for path in (self._contents_path, self._embeddings_path):
+                if os.path.exists(path):
+                    orphan_path = f"{path}.orphaned-{int(time.time())}"
+                    logger.warning("Missing companion store file, moving %s to %s", path, orphan_path)
+                    os.replace(path, orphan_path)
+            open(self._contents_path, 'w').close()
+            open(self._embeddings_path, 'wb').close()
+            return
+        
+        # A crash inside _persist can leave a torn last line; keep only the records before it
+        records = []
+        torn = False
+        with open(self._contents_path, 'rb') as contents_file:
+            for line in contents_file:
+                if not line.endswith(b"\n"):
+                    torn = True
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    torn = True
+                    break
+        row_bytes = EMBEDDING_DIM * np.dtype(EMBEDDING_DTYPE).itemsize
+        stored_rows = os.path.getsize(self._embeddings_path) // row_bytes
+        count = min(len(records), stored_rows)
+        
+        # Drop a partially written tail so both files stay aligned for appends
+        if torn or len(records) != count or os.path.getsize(self._embeddings_path) != count * row_bytes:
+            logger.warning("Truncating persisted document store to %d consistent chunks", count)
+            os.truncate(self._embeddings_path, count * row_bytes)
+            with open(self._contents_path, 'w', encoding='utf-8') as contents_file:
+                for record in records[:count]:
+                    contents_file.write(json.dumps(record) + "\n")
         
-    def add_document(self, content: str, filename: str):
+        self.contents = [record["content"] for record in records[:count]]
+        self.filenames = [record["filename"] for record in records[:count]]
+        self._stored_keys = {chunk_key(content) for content in self.contents}
+        self.embeddings = self._map_embeddings(count)
+        if self.index is not None:
+            for start in range(0, count, SIMILARITY_BLOCK_ROWS):
+                self.index.add(self.embeddings[start:start + SIMILARITY_BLOCK_ROWS].astype(np.float32))
+        logger.info("Loaded %d persisted chunks from %s", count, self.storage_dir)
+    
+    def _persist(self, embeddings: np.ndarray, chunks: List[str], filename: str):
+        """Append new chunks and their embeddings to storage, rolling back on failure."""
+        embeddings_size = os.path.getsize(self._embeddings_path)
+        contents_size = os.path.getsize(self._contents_path)
+        try:
+            with open(self._embeddings_path, 'ab') as embeddings_file:
+                embeddings_file.write(np.ascontiguousarray(embeddings, dtype=EMBEDDING_DTYPE).tobytes())
+                embeddings_file.flush()
+                os.fsync(embeddings_file.fileno())
+            with open(self._contents_path, 'a', encoding='utf-8') as contents_file:
+                for chunk in chunks:
+                    contents_file.write(json.dumps({"content": chunk, "filename": filename}) + "\n")
+                contents_file.flush()
+                os.fsync(contents_file.fileno())
+        except BaseException:
+            # Leave no orphan rows or partial lines for the next append to misalign against
+            os.truncate(self._embeddings_path, embeddings_size)
+            os.truncate(self._contents_path, contents_size)
+            raise
+        
+    async def add_document(self, content: str, filename: str):
+        chunks, embeddings = await self.prepare_document(content, filename)
+        self.commit_document(chunks, embeddings, filename)
+    
+    async def prepare_document(self, content: str, filename: str) -> Tuple[List[str], np.ndarray]:
+        """Chunk and embed a document without adding it to the store."""
         chunks = self._create_chunks(content)
+        if not chunks:
+            logger.warning("No text content to store for document: %s", filename)
+            return [], np.empty((0, EMBEDDING_DIM), dtype=EMBEDDING_DTYPE)
         
-        # Generate embeddings for each chunk
+        # Chunks already in the store are never sent to the embeddings API again
+        new_chunks = [chunk for chunk in chunks if chunk_key(chunk) not in self._stored_keys]
+        if len(new_chunks) < len(chunks):
+            logger.info("%d chunks from %s are already stored", len(chunks) - len(new_chunks), filename)
+        if not new_chunks:
+            return [], np.empty((0, EMBEDDING_DIM), dtype=EMBEDDING_DTYPE)
+        chunks = new_chunks
+        
+        # Generate embeddings for all chunks in batched requests
         try:
-            for chunk in chunks:
-                embedding = self._generate_embedding(chunk)
-                self.documents.append({
-                    "content": chunk,
-                    "embedding": embedding,
-                    "filename": filename
-                })
-            logger.info(f"Successfully processed and stored document: {filename}")
+            return chunks, await self._embed_chunks(chunks)
         except Exception as e:
-            logger.error(f"Error generating embeddings for {filename}: {str(e)}")
+            logger.error("Error generating embeddings for %s: %s", filename, e)
             raise
     
+    def commit_document(self, chunks: List[str], embeddings: np.ndarray, filename: str):
+        """Add prepared chunks to the store; runs without awaiting so it is never interrupted."""
+        # Skip chunks already stored, e.g. when a proposal is uploaded again
+        new_rows = []
+        new_keys = set()
+        for row, chunk in enumerate(chunks):
+            key = chunk_key(chunk)
+            if key not in self._stored_keys and key not in new_keys:
+                new_keys.add(key)
+                new_rows.append(row)
+        if len(new_rows) < len(chunks):
+            logger.info("Skipping %d already stored chunks from %s", len(chunks) - len(new_rows), filename)
+        if not new_rows:
+            return
+        chunks = [chunks[row] for row in new_rows]
+        embeddings = embeddings[new_rows]
+        
+        if self.storage_dir:
+            self._persist(embeddings, chunks, filename)
+            self.embeddings = self._map_embeddings(len(self.contents) + len(chunks))
+        else:
+            self.embeddings = np.vstack([self.embeddings, embeddings])
+        if self.index is not None:
+            self.index.add(embeddings.astype(np.float32))
+        # Only recorded once the chunks are actually stored, so a failed append can be retried
+        self._stored_keys.update(new_keys)
+        self.contents.extend(chunks)
+        self.filenames.extend([filename] * len(chunks))
+        # Cached retrievals did not consider the new chunks
+        self.query_cache.clear()
+        logger.info("Successfully processed and stored document: %s", filename)
+    
     def _create_chunks(self, text: str) -> List[str]:
-        """Split text into overlapping chunks."""
-        chunks = []
-        start = 0
-        while start < len(text):
-            end = start + self.chunk_size
-            chunk = text[start:end]
-            chunks.append(chunk)
-            start = end - self.chunk_overlap
-        return chunks
+        """Split text into overlapping token windows."""
+        # Special-token strings such as <|endoftext|> are ordinary document text here
+        tokens = encoding.encode(text, disallowed_special=())
+        step = self.chunk_size - self.chunk_overlap
+        starts = np.arange(0, len(tokens), step)
+        ends = np.minimum(starts + self.chunk_size, len(tokens))
+        return [encoding.decode(tokens[start:end]) for start, end in zip(starts.tolist(), ends.tolist())]
     
-    def _generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding for a chunk of text."""
+    async def _embed_chunks(self, chunks: List[str]) -> np.ndarray:
+        """Return normalized embeddings for chunks, reusing cached vectors where possible."""
+        keys = [chunk_key(chunk) for chunk in chunks]
+        
+        # Embed each distinct uncached chunk only once
+        missing: Dict[bytes, str] = {}
+        cached: Dict[bytes, np.ndarray] = {}
+        for key, chunk in zip(keys, chunks):
+            if key in self._emb_cache:
+                self._emb_cache.move_to_end(key)
+                cached[key] = self._emb_cache[key]
+            else:
+                missing.setdefault(key, chunk)
+        
+        new_vectors: Dict[bytes, np.ndarray] = {}
+        if missing:
+            embeddings = await self._generate_embeddings(list(missing.values()))
+            embeddings = normalize_embeddings(embeddings)
+            new_vectors = dict(zip(missing.keys(), embeddings.astype(EMBEDDING_DTYPE)))
+            logger.info("Embedded %d new chunks, reused %d cached", len(missing), len(chunks) - len(missing))
+        
+        for key, vector in new_vectors.items():
+            self._emb_cache[key] = vector
+            if len(self._emb_cache) > EMBEDDING_CACHE_SIZE:
+                self._emb_cache.popitem(last=False)
+        return np.stack([
+            new_vectors[key] if key in new_vectors else cached[key]
+            for key in keys
+        ])
+    
+    async def _generate_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Generate embeddings for a list of texts, batching API requests."""
         try:
-            response = client.embeddings.create(
-                model="text-embedding-ada-002",
-                input=text
-            )
-            return response.data[0].embedding
+            batches = [texts[start:start + EMBEDDING_BATCH_SIZE] for start in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+            # A batch that finally fails cancels the rest instead of letting them spend quota
+            try:
+                async with asyncio.TaskGroup() as task_group:
+                    tasks = [task_group.create_task(embed_batch(batch)) for batch in batches]
+            except ExceptionGroup as group:
+                raise group.exceptions[0]
+            return np.concatenate([task.result() for task in tasks])
         except Exception as e:
-            logger.error(f"Error generating embedding: {str(e)}")
+            logger.error("Error generating embeddings: %s", e)
             raise
 
-    def get_relevant_chunks(self, query: str, top_k: int = 3) -> List[str]:
+    def _compute_similarities(self, query_embedding: np.ndarray) -> np.ndarray:
+        """Compute cosine similarity between a normalized query and every stored chunk.
+        
+        Only used when faiss is not installed.
+        """
+        if SIMSIMD_AVAILABLE:
+            query = query_embedding.astype(EMBEDDING_DTYPE)[np.newaxis, :]
+            # Rows are unit length, so the dot product is the cosine similarity
+            return np.asarray(simsimd.cdist(query, self.embeddings, metric="dot"))[0]
+        
+        # NumPy has no fast fp16 matmul, so upcast bounded blocks of rows.
+        # Rows are unit length, so the matrix-vector product gives every cosine similarity.
+        similarities = np.empty(len(self.embeddings), dtype=np.float32)
+        for start in range(0, len(self.embeddings), SIMILARITY_BLOCK_ROWS):
+            block = self.embeddings[start:start + SIMILARITY_BLOCK_ROWS].astype(np.float32)
+            similarities[start:start + SIMILARITY_BLOCK_ROWS] = block @ query_embedding
+        return similarities
+
+    def _search(self, query_embedding: np.ndarray, top_k: int) -> List[str]:
+        """Return the top_k stored chunks for a normalized query embedding."""
+        # faiss is the primary backend; the linear scan below is its fallback
+        if self.index is not None:
+            _, indices = self.index.search(query_embedding[np.newaxis, :], top_k)
+            return [self.contents[i] for i in indices[0] if i != -1]
+        
+        similarities = self._compute_similarities(query_embedding)
+        
+        # Partially select the top chunks in O(N), then order just those
+        top_indices = np.arange(len(similarities))
+        if top_k < len(similarities):
+            top_indices = np.argpartition(-similarities, top_k)[:top_k]
+        top_indices = top_indices[np.argsort(-similarities[top_indices])]
+        return [self.contents[i] for i in top_indices]
+    
+    def _lookup_query_cache(self, query: str, query_embedding: Optional[np.ndarray], top_k: int) -> Optional[List[str]]:
+        """Return cached chunks for an identical or near-identical earlier query."""
+        now = time.monotonic()
+        self.query_cache = [entry for entry in self.query_cache if now - entry[4] < QUERY_CACHE_TTL]
+        
+        candidates = [i for i, entry in enumerate(self.query_cache) if entry[1] == top_k]
+        if not candidates:
+            return None
+        
+        if query_embedding is None:
+            matches = [i for i in candidates if self.query_cache[i][0] == query]
+        else:
+            cached_embeddings = np.stack([self.query_cache[i][2] for i in candidates])
+            similarities = cached_embeddings @ query_embedding
+            best = int(np.argmax(similarities))
+            matches = [candidates[best]] if similarities[best] > QUERY_CACHE_THRESHOLD else []
+        if not matches:
+            return None
+        
+        # Move the hit to the most recently used end
+        entry = self.query_cache.pop(matches[0])
+        self.query_cache.append(entry)
+        return entry[3]
+    
+    async def get_relevant_chunks(self, query: str, top_k: int = 3) -> List[str]:
         """Get most relevant chunks for a query using cosine similarity."""
-        if not self.documents:
+        if not self.contents:
             return []
             
         try:
-            query_embedding = self._generate_embedding(query)
+            # An identical query skips even the embedding request
+            cached = self._lookup_query_cache(query, None, top_k)
+            if cached is not None:
+                logger.info("Reusing relevant chunks for repeated query")
+                return cached
+            
+            query_embedding = (await self._generate_embeddings([query]))[0]
+            query_embedding = normalize_embeddings(query_embedding)
             
-            # Calculate similarities
-            similarities = []
-            for doc in self.documents:
-                similarity = cosine_similarity(
-                    [query_embedding],
-                    [doc["embedding"]]
-                )[0][0]
-                similarities.append((similarity, doc["content"]))
+            cached = self._lookup_query_cache(query, query_embedding, top_k)
+            if cached is not None:
+                logger.info("Reusing relevant chunks for similar query")
+                return cached
             
-            # Sort by similarity and return top chunks
-            similarities.sort(reverse=True)
-            return [content for _, content in similarities[:top_k]]
+            relevant_chunks = self._search(query_embedding, top_k)
+            self.query_cache.append((query, top_k, query_embedding, relevant_chunks, time.monotonic()))
+            if len(self.query_cache) > QUERY_CACHE_SIZE:
+                self.query_cache.pop(0)
+            return relevant_chunks
             
         except Exception as e:
-            logger.error(f"Error getting relevant chunks: {str(e)}")
+            logger.error("Error getting relevant chunks: %s", e)
             return []
 
-document_store = DocumentStore()
+# Created at startup rather than import, so only the serving process loads or repairs storage
+document_store: Optional[DocumentStore] = None
 
-def extract_text_from_file(file_content: bytes, filename: str) -> str:
-    """Extract text from various file formats."""
-    logger.info(f"Extracting text from {filename}")
-    
-    try:
-        if filename.endswith('.txt'):
-            return file_content.decode('utf-8')
+@app.on_event("startup")
+def load_document_store():
+    global document_store
+    document_store = DocumentStore(
+        os.getenv("DOCUMENT_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "document_store"))
+    )
+
+def copy_upload_to_path(file: UploadFile, path: str):
+    """Stream an uploaded file to path without holding it in memory."""
+    total_bytes = 0
+    with open(path, 'wb') as temp_file:
+        while block := file.file.read(UPLOAD_READ_BYTES):
+            total_bytes += len(block)
+            # Content-Length may be missing or wrong, so enforce the cap while copying
+            if total_bytes > MAX_UPLOAD_BYTES:
+                raise ValueError(f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB size limit")
+            temp_file.write(block)
+
+async def process_upload(file: UploadFile) -> Tuple[List[str], np.ndarray]:
+    """Stream, extract and embed a single uploaded file without storing it."""
+    async with upload_semaphore:
+        logger.info("Processing file: %s", file.filename)
         
-        # For doc/docx files
-        if TEXTRACT_AVAILABLE:
-            # Save temporarily and use textract
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as temp_file:
-                temp_file.write(file_content)
-                temp_file_path = temp_file.name
+        # Created on the event loop so cleanup always knows the path, even if cancelled mid-copy
+        temp_fd, temp_file_path = tempfile.mkstemp(suffix=os.path.splitext(file.filename)[1])
+        os.close(temp_fd)
+        copy_task = asyncio.ensure_future(asyncio.to_thread(copy_upload_to_path, file, temp_file_path))
+        try:
+            # Shielded so cancelling this upload does not abandon the copy thread's future
+            await asyncio.shield(copy_task)
+            logger.info("Saved %d bytes from %s", os.path.getsize(temp_file_path), file.filename)
             
-            try:
-                # Extract text using textract
-                text = textract.process(temp_file_path).decode('utf-8')
-                logger.info(f"Successfully extracted text from {filename} using textract")
-                return text
-            finally:
-                # Clean up temporary file
-                os.unlink(temp_file_path)
-                logger.info(f"Cleaned up temporary file for {filename}")
-        else:
-            # If textract is not available, only support txt files
-            if not filename.endswith('.txt'):
-                raise HTTPException(
-                    status_code=400,
-                    detail="Only .txt files are supported without textract installation"
-                )
-            return file_content.decode('utf-8')
-    
-    except Exception as e:
-        logger.error(f"Error extracting text from {filename}: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error processing file {filename}: {str(e)}"
-        )
+            # Extraction is blocking, keep it off the event loop
+            text_content = await asyncio.get_running_loop().run_in_executor(
+                extract_pool, extract_text_from_file, temp_file_path, file.filename
+            )
+            prepared = await document_store.prepare_document(text_content, file.filename)
+            logger.info("Successfully processed %s", file.filename)
+            return prepared
+        except Exception as e:
+            logger.error("Failed to process %s: %s", file.filename, e)
+            raise HTTPException(
+                status_code=400,
+                detail=f"Error processing file {file.filename}: {str(e)}"
+            )
+        finally:
+            # The copy thread cannot be interrupted; let it finish before removing
+            # its file and closing the upload it reads from
+            await asyncio.gather(copy_task, return_exceptions=True)
+            os.unlink(temp_file_path)
+            logger.info("Cleaned up temporary file for %s", file.filename)
+            await file.close()
+            logger.info("Closed file: %s", file.filename)
+
+async def process_uploads(files: List[UploadFile]) -> List[Tuple[List[str], np.ndarray]]:
+    """Process files concurrently, cancelling the rest as soon as one fails."""
+    try:
+        async with asyncio.TaskGroup() as task_group:
+            tasks = [task_group.create_task(process_upload(file)) for file in files]
+    except ExceptionGroup as group:
+        raise group.exceptions[0]
+    return [task.result() for task in tasks]
 
 @app.post("/api/upload")
 async def upload_files(files: List[UploadFile] = File(...)):
-    logger.info(f"Received upload request with {len(files)} files")
+    logger.info("Received upload request with %d files", len(files))
     
     if not files:
         logger.warning("No files provided in request")
         raise HTTPException(status_code=400, detail="No files provided")
     
     if len(files) > 5:
-        logger.warning(f"Too many files: {len(files)}")
+        logger.warning("Too many files: %d", len(files))
         raise HTTPException(status_code=400, detail="Maximum 5 files allowed")
     
-    allowed_extensions = ('.txt',) if not TEXTRACT_AVAILABLE else ('.txt', '.doc', '.docx')
+    if TEXTRACT_AVAILABLE:
+        allowed_extensions = ('.txt', '.doc', '.docx')
+    elif DOCX_AVAILABLE:
+        allowed_extensions = ('.txt', '.docx')
+    else:
+        allowed_extensions = ('.txt',)
+    
+    # Reject the whole request before any file is processed
+    for file in files:
+        if not file.filename.lower().endswith(allowed_extensions):
+            logger.warning("Invalid file type: %s", file.filename)
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Unsupported file type for {file.filename}. Only {', '.join(allowed_extensions)} files are allowed."
+            )
+        
+        if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+            logger.warning("File too large: %s (%d bytes)", file.filename, file.size)
+            raise HTTPException(
+                status_code=400,
+                detail=f"File {file.filename} exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB size limit"
+            )
     
     try:
-        for file in files:
-            logger.info(f"Processing file: {file.filename}")
-            
-            if not file.filename.lower().endswith(allowed_extensions):
-                logger.warning(f"Invalid file type: {file.filename}")
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Unsupported file type for {file.filename}. Only {', '.join(allowed_extensions)} files are allowed."
-                )
-            
-            content = await file.read()
-            logger.info(f"Read {len(content)} bytes from {file.filename}")
-            
-            try:
-                text_content = extract_text_from_file(content, file.filename)
-                document_store.add_document(text_content, file.filename)
-                logger.info(f"Successfully processed {file.filename}")
-            except Exception as e:
-                logger.error(f"Failed to process {file.filename}: {str(e)}")
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Error processing file {file.filename}: {str(e)}"
-                )
-            finally:
-                await file.close()
-                logger.info(f"Closed file: {file.filename}")
+        prepared = await process_uploads(files)
+        
+        # Store nothing unless every file in the request succeeded
+        for file, (chunks, embeddings) in zip(files, prepared):
+            document_store.commit_document(chunks, embeddings, file.filename)
         
         return {
             "message": "Files uploaded successfully",
@@ -210,14 +605,16 @@ async def upload_files(files: List[UploadFile] = File(...)):
             "status": "success",
             "textract_available": TEXTRACT_AVAILABLE
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error in upload process: {str(e)}")
+        logger.error("Error in upload process: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 async def generate_proposal_chunk(prompt: str) -> str:
     """Generate a single chunk of the proposal."""
     try:
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="gpt-4",
             messages=[
                 {"role": "system", "content": """You are a professional grant writer. Generate a grant proposal based on the given requirements while maintaining a professional tone and following standard grant writing practices.
@@ -227,7 +624,7 @@ async def generate_proposal_chunk(prompt: str) -> str:
         )
         return response.choices[0].message.content
     except Exception as e:
-        logger.error(f"Error generating proposal chunk: {str(e)}")
+        logger.error("Error generating proposal chunk: %s", e)
         raise
 
 @app.post("/api/generate")
@@ -240,10 +637,10 @@ async def generate_proposal(body: Dict[str, str] = Body(...)):
     
     try:
         requirements = body["requirements"]
-        logger.info(f"Generating proposal for requirements: {requirements[:100]}...")
+        logger.info("Generating proposal for requirements: %s...", requirements[:100])
         
         # Get relevant chunks from uploaded documents
-        relevant_chunks = document_store.get_relevant_chunks(requirements)
+        relevant_chunks = await document_store.get_relevant_chunks(requirements)
         context = ""
         if relevant_chunks:
             context = "\n\nRelevant reference materials:\n" + "\n---\n".join(relevant_chunks)
@@ -257,7 +654,7 @@ async def generate_proposal(body: Dict[str, str] = Body(...)):
         logger.info("Successfully generated proposal")
         return {"proposal": proposal}
     except Exception as e:
-        logger.error(f"Error generating proposal: {str(e)}")
+        logger.error("Error generating proposal: %s", e)
         raise HTTPException(status_code=500, detail=f"Error generating proposal: {str(e)}")
 
 @app.get("/health")
@@ -265,6 +662,6 @@ async def health_check():
     logger.info("Health check requested")
     return {
         "status": "healthy",
-        "document_count": len(document_store.documents),
+        "document_count": len(document_store.contents),
         "textract_available": TEXTRACT_AVAILABLE
     }
\ No newline at end of file